@@ -1,28 +1,87 @@
 from flask import Flask
+from flask.cli import with_appcontext
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
+import click
 import os
 
-app = Flask(__name__)
-CORS(app)
+# Extensions are created unbound and attached to each app in create_app
+db = SQLAlchemy()
+jwt = JWTManager()
 
-app.config['SECRET_KEY'] = 'your_secret_key'  # Change this! Use an environment variable in production
-app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///gamers.db"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = 30 * 60  # 30 minutes (in seconds)
 
-db = SQLAlchemy(app)
-jwt = JWTManager(app)
+def create_app(config=None):
+    app = Flask(__name__)
+    CORS(app)
+
+    app.config['SECRET_KEY'] = 'your_secret_key'  # Change this! Use an environment variable in production
+    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///gamers.db"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = 30 * 60  # 30 minutes (in seconds)
+    app.config["RESERVATION_HOLD_MINUTES"] = 15  # Keep a machine free this long before a booking starts
+    app.config["ARCHIVE_AFTER_DAYS"] = 90  # Closed sessions and transactions older than this move to the archive
+    app.config["ARCHIVE_DIR"] = os.environ.get("ARCHIVE_DIR")  # Defaults to <instance>/archive
+    app.config["ARCHIVE_BATCH_SIZE"] = 1000  # Rows archived per commit
+    app.config["IDEMPOTENCY_TTL_SECONDS"] = 60 * 60  # How long a retried request replays its first response
+    app.config["IDEMPOTENCY_MAX_KEYS"] = 10000
+    app.config["HEARTBEAT_TOKEN"] = os.environ.get("HEARTBEAT_TOKEN")  # Shared by all stations; pings are rejected until it is set
+    app.config["HEARTBEAT_FLUSH_SECONDS"] = 5  # Buffered pings are written to the database this often
+    app.config["HEARTBEAT_TIMEOUT_SECONDS"] = 30  # A station is offline after this long without a ping
+    app.config["BULK_MAX_ROWS"] = 1000  # Largest import accepted by the /api/users/bulk routes
+    app.config["BULK_HASH_WORKERS"] = os.cpu_count() or 1  # Processes used to hash imported passwords
+
+    if config:
+        app.config.update(config)
+
+    if not app.config["HEARTBEAT_TOKEN"]:
+        app.logger.warning('HEARTBEAT_TOKEN is not set, station heartbeats are disabled')
+
+    db.init_app(app)
+    jwt.init_app(app)
+
+    # Import and register routes (after db is defined)
+    from routes import api
+    from archive import archive_command
+    from heartbeats import HeartbeatBuffer
+    from idempotency import IdempotencyStore
+    from reservations import ReservationIndex
+    app.register_blueprint(api)
+    app.extensions['reservations'] = ReservationIndex()
+    app.extensions['idempotency'] = IdempotencyStore(
+        max_entries=app.config["IDEMPOTENCY_MAX_KEYS"],
+        ttl_seconds=app.config["IDEMPOTENCY_TTL_SECONDS"]
+    )
+    app.extensions['heartbeats'] = HeartbeatBuffer()
+    app.cli.add_command(archive_command)
+    app.cli.add_command(init_db_command)
+
+    return app
+
+
+@click.command('init-db')
+@click.option('--check', is_flag=True, help='Only report missing tables, exit 1 if any.')
+@click.pass_context
+@with_appcontext
+def init_db_command(ctx, check):
+    """Create the database tables (run once before starting the server)."""
+    import models  # Registers every table on db.metadata
+
+    existing = set(db.inspect(db.engine).get_table_names())
+    missing = sorted(set(db.metadata.tables) - existing)
+
+    if check:
+        if missing:
+            click.echo(f"Missing tables: {', '.join(missing)}")
+            ctx.exit(1)
+        click.echo('Database schema is up to date')
+        return
 
-# Create the database tables within the app context
-with app.app_context():
-    # Import models (after db is defined)
-    from models import User, Machine, Session, Transaction  # Added missing imports
     db.create_all()
+    click.echo(f"Created tables: {', '.join(missing)}" if missing else 'Database schema is up to date')
 
-# Import and register routes
-import routes
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    # Import through the module name so routes and models share the same db instance
+    from app import create_app
+    create_app().run(debug=True)
@@ -0,0 +1,318 @@
+import click
+import os
+import sqlite3
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.orm import joinedload
+
+from app import db
+from models import Session, Transaction, ArchiveSummary
+
+SESSION_COLUMNS = (
+    "id", "user_id", "username", "machine_id", "machine_name", "machine_type",
+    "hourly_rate", "start_time", "end_time", "duration", "amount_charged"
+)
+TRANSACTION_COLUMNS = (
+    "id", "user_id", "username", "amount", "transaction_type", "description",
+    "timestamp", "session_id"
+)
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    machine_id INTEGER NOT NULL,
+    machine_name TEXT,
+    machine_type TEXT,
+    hourly_rate REAL,
+    start_time TEXT,
+    end_time TEXT,
+    duration REAL,
+    amount_charged REAL
+);
+CREATE INDEX IF NOT EXISTS ix_session_user ON session (user_id);
+CREATE TABLE IF NOT EXISTS "transaction" (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    amount REAL NOT NULL,
+    transaction_type TEXT NOT NULL,
+    description TEXT,
+    timestamp TEXT,
+    session_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_transaction_user ON "transaction" (user_id);
+"""
+
+
+def archive_dir():
+    return current_app.config.get('ARCHIVE_DIR') or os.path.join(current_app.instance_path, 'archive')
+
+
+def archive_path(month):
+    return os.path.join(archive_dir(), f'{month}.db')
+
+
+def list_months():
+    """Return the archived months (YYYY-MM), oldest first."""
+    if not os.path.isdir(archive_dir()):
+        return []
+    return sorted(name[:-3] for name in os.listdir(archive_dir()) if name.endswith('.db'))
+
+
+def month_key(value):
+    return value.strftime('%Y-%m')
+
+
+def _utc_iso(value):
+    return value.replace(tzinfo=dt_timezone.utc).isoformat() if value else None
+
+
+def _session_row(session):
+    return (
+        session.id,
+        session.user_id,
+        session.user.username if session.user else None,
+        session.machine_id,
+        session.machine.name if session.machine else None,
+        session.machine.machine_type if session.machine else None,
+        session.machine.hourly_rate if session.machine else None,
+        _utc_iso(session.start_time),
+        _utc_iso(session.end_time),
+        session.duration,
+        session.amount_charged
+    )
+
+
+def _transaction_row(transaction):
+    return (
+        transaction.id,
+        transaction.user_id,
+        transaction.user.username if transaction.user else None,
+        transaction.amount,
+        transaction.transaction_type,
+        transaction.description,
+        _utc_iso(transaction.timestamp),
+        transaction.session_id
+    )
+
+
+def _write_partition(month, session_rows, transaction_rows):
+    os.makedirs(archive_dir(), exist_ok=True)
+    connection = sqlite3.connect(archive_path(month))
+    try:
+        connection.executescript(ARCHIVE_SCHEMA)
+        # INSERT OR REPLACE keeps a re-run safe if the main database commit failed last time
+        connection.executemany(
+            f'INSERT OR REPLACE INTO session ({", ".join(SESSION_COLUMNS)}) '
+            f'VALUES ({", ".join("?" * len(SESSION_COLUMNS))})',
+            session_rows
+        )
+        connection.executemany(
+            f'INSERT OR REPLACE INTO "transaction" ({", ".join(TRANSACTION_COLUMNS)}) '
+            f'VALUES ({", ".join("?" * len(TRANSACTION_COLUMNS))})',
+            transaction_rows
+        )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _lock_database():
+    # Take SQLite's write lock before reading, so a concurrent run (the CLI and
+    # POST /api/archive/run, or two workers) waits instead of folding the same
+    # rows into ArchiveSummary twice
+    db.session.execute(db.text('BEGIN IMMEDIATE'))
+
+
+def _archive_batch(sessions, transactions):
+    """Write one batch to the monthly files, fold it into ArchiveSummary and delete it. Commits."""
+    partitions = defaultdict(lambda: ([], []))
+    totals = defaultdict(lambda: {'sessions_count': 0, 'hours': 0.0, 'session_revenue': 0.0, 'deposits': 0.0, 'last_visit': None})
+
+    for session in sessions:
+        month = month_key(session.end_time)
+        partitions[month][0].append(_session_row(session))
+        summary = totals[(month, session.user_id)]
+        summary['sessions_count'] += 1
+        summary['hours'] += session.duration or 0.0
+        if summary['last_visit'] is None or session.end_time > summary['last_visit']:
+            summary['last_visit'] = session.end_time
+
+    for transaction in transactions:
+        month = month_key(transaction.timestamp)
+        partitions[month][1].append(_transaction_row(transaction))
+        summary = totals[(month, transaction.user_id)]
+        if transaction.transaction_type == 'session_charge':
+            summary['session_revenue'] += abs(transaction.amount)
+        elif transaction.transaction_type == 'deposit':
+            summary['deposits'] += transaction.amount
+
+    for month, (session_rows, transaction_rows) in partitions.items():
+        _write_partition(month, session_rows, transaction_rows)
+
+    existing = {
+        (summary.month, summary.user_id): summary
+        for summary in ArchiveSummary.query.filter(
+            ArchiveSummary.month.in_(list(partitions))
+        ).all()
+    }
+    for key, values in totals.items():
+        summary = existing.get(key)
+        if not summary:
+            summary = ArchiveSummary(
+                month=key[0], user_id=key[1], sessions_count=0,
+                hours=0.0, session_revenue=0.0, deposits=0.0
+            )
+            db.session.add(summary)
+        summary.sessions_count += values['sessions_count']
+        summary.hours += values['hours']
+        summary.session_revenue += values['session_revenue']
+        summary.deposits += values['deposits']
+        if values['last_visit'] and (summary.last_visit is None or values['last_visit'] > summary.last_visit):
+            summary.last_visit = values['last_visit']
+
+    # Delete exactly the rows that were archived
+    transaction_ids = [transaction.id for transaction in transactions]
+    session_ids = [session.id for session in sessions]
+    if transaction_ids:
+        Transaction.query.filter(Transaction.id.in_(transaction_ids)).delete(synchronize_session=False)
+    if session_ids:
+        Session.query.filter(Session.id.in_(session_ids)).delete(synchronize_session=False)
+
+    db.session.commit()
+
+
+def archive_old_records(older_than_days=None):
+    """Move closed sessions and transactions older than the cutoff into monthly archive files.
+
+    Rows are handled ARCHIVE_BATCH_SIZE at a time, each batch under the write
+    lock and in its own commit, so memory stays flat however much history there
+    is. Per-user monthly totals are folded into ArchiveSummary in the same
+    commit that deletes the rows, so analytics keep seeing the full history.
+    Returns the number of sessions and transactions archived.
+    """
+    if older_than_days is None:
+        older_than_days = current_app.config['ARCHIVE_AFTER_DAYS']
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    batch_size = current_app.config['ARCHIVE_BATCH_SIZE']
+    archived = {'sessions': 0, 'transactions': 0}
+
+    try:
+        # Sessions first, taking their charges along even if they were stamped just after the cutoff
+        while True:
+            _lock_database()
+            sessions = Session.query.options(
+                joinedload(Session.user), joinedload(Session.machine)
+            ).filter(
+                Session.is_active == False, Session.end_time < cutoff
+            ).order_by(Session.id).limit(batch_size).all()
+            if not sessions:
+                db.session.rollback()
+                break
+
+            transactions = Transaction.query.options(
+                joinedload(Transaction.user)
+            ).filter(
+                Transaction.session_id.in_([session.id for session in sessions])
+            ).all()
+            _archive_batch(sessions, transactions)
+            archived['sessions'] += len(sessions)
+            archived['transactions'] += len(transactions)
+
+        # Then the remaining old transactions (deposits, refunds and the like)
+        while True:
+            _lock_database()
+            transactions = Transaction.query.options(
+                joinedload(Transaction.user)
+            ).filter(
+                Transaction.timestamp < cutoff
+            ).order_by(Transaction.id).limit(batch_size).all()
+            if not transactions:
+                db.session.rollback()
+                break
+
+            _archive_batch([], transactions)
+            archived['transactions'] += len(transactions)
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return archived
+
+
+def _localize(value):
+    # Match the Asia/Kolkata timestamps returned by the live to_json methods
+    if not value:
+        return None
+    from pytz import timezone
+    return datetime.fromisoformat(value).astimezone(timezone('Asia/Kolkata')).isoformat()
+
+
+def forget_users(user_ids):
+    """Detach deleted users from their archived totals so a later user with the same id can't inherit them.
+
+    The monthly totals stay (with user_id NULL) so revenue analytics are unchanged.
+    Runs in the caller's transaction.
+    """
+    if user_ids:
+        ArchiveSummary.query.filter(ArchiveSummary.user_id.in_(list(user_ids))).update(
+            {'user_id': None}, synchronize_session=False
+        )
+
+
+def load_archived(kind, month, user_id=None, username=None):
+    """Read archived sessions or transactions for one month, opening the file only when asked.
+
+    Rows are matched on username as well as user_id when given, so history from a
+    deleted account never shows up under a new account that was given the same id.
+    """
+    path = archive_path(month)
+    if not os.path.exists(path):
+        return []
+
+    table = 'session' if kind == 'sessions' else '"transaction"'
+    order_column = 'start_time' if kind == 'sessions' else 'timestamp'
+    query = f'SELECT * FROM {table}'
+    params = ()
+    if user_id is not None:
+        query += ' WHERE user_id = ?'
+        params = (user_id,)
+        if username is not None:
+            query += ' AND username = ?'
+            params += (username,)
+    query += f' ORDER BY {order_column} DESC'
+
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = [dict(row) for row in connection.execute(query, params)]
+    finally:
+        connection.close()
+
+    for row in rows:
+        for column in ('start_time', 'end_time', 'timestamp'):
+            if column in row:
+                row[column] = _localize(row[column])
+        row['is_archived'] = True
+        if kind == 'sessions':
+            row['is_active'] = False
+    return rows
+
+
+@click.command('archive')
+@click.option('--older-than-days', type=int, default=None, help='Override ARCHIVE_AFTER_DAYS.')
+@click.option('--vacuum', is_flag=True, help='Reclaim freed space in the main database afterwards.')
+@with_appcontext
+def archive_command(older_than_days, vacuum):
+    """Move old closed sessions and transactions into monthly archive files."""
+    result = archive_old_records(older_than_days)
+    click.echo(f"Archived {result['sessions']} sessions and {result['transactions']} transactions")
+    if vacuum:
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql('VACUUM')
+        click.echo('Vacuumed main database')
@@ -0,0 +1,124 @@
+"""Measure app startup and heartbeat ingestion cost.
+
+Run from the backend directory: python benchmark.py [--runs N]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import os
+import time
+
+# Schema, a few machines and an admin token, so timed requests go through
+# auth, the database, the models and to_json like real traffic does
+SETUP = """
+import os, tempfile
+def setup(app):
+    # Imported here so the app's modules are not loaded before the timer starts
+    from flask_jwt_extended import create_access_token
+    from app import db
+    with app.app_context():
+        import models
+        db.create_all()
+        db.session.add_all(models.Machine(name=f'PC {i}', machine_type='Standard', hourly_rate=1) for i in range(20))
+        db.session.commit()
+        token = create_access_token(identity='1', additional_claims={'is_admin': True})
+        db.engine.dispose()
+    return {'Authorization': f'Bearer {token}'}
+def first_request(app, headers):
+    with app.test_client() as client:
+        response = client.get('/api/machines', headers=headers)
+    assert response.status_code == 200, response.get_data(as_text=True)
+database_uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+"""
+
+COLD_START = SETUP + """
+import time
+started = time.perf_counter()
+from app import create_app
+app = create_app({'SQLALCHEMY_DATABASE_URI': database_uri})
+created = time.perf_counter()
+headers = setup(app)
+requested = time.perf_counter()
+first_request(app, headers)
+print(created - started, time.perf_counter() - requested)
+"""
+
+FORKED_START = SETUP + """
+import time
+from app import create_app
+app = create_app({'SQLALCHEMY_DATABASE_URI': database_uri})
+headers = setup(app)
+started = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+    first_request(app, headers)
+    os._exit(0)
+_, status = os.waitpid(pid, 0)
+assert status == 0
+print(time.perf_counter() - started)
+"""
+
+HEARTBEAT_INGEST = """
+import os, tempfile, time
+from sqlalchemy import event
+from app import create_app, db
+path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'HEARTBEAT_TOKEN': 'bench'})
+with app.app_context():
+    import models
+    db.create_all()
+    db.session.add_all(models.Machine(name=f'PC {i}', machine_type='Standard', hourly_rate=1) for i in range(200))
+    db.session.commit()
+    commits = []
+    event.listen(db.engine, 'commit', lambda connection: commits.append(1))
+buffer = app.extensions['heartbeats']
+headers = {'X-Station-Token': app.config['HEARTBEAT_TOKEN']}
+with app.test_client() as client:
+    started = time.perf_counter()
+    for i in range(2000):
+        client.post('/api/machines/heartbeat', json={'machine_id': i % 200 + 1, 'state': 'ok'}, headers=headers)
+    elapsed = time.perf_counter() - started
+with app.app_context():
+    buffer.flush()
+print(elapsed / 2000, len(commits))
+"""
+
+
+def run(script, runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', script], capture_output=True, text=True, check=True
+        ).stdout.split()
+        samples.append([float(value) for value in output])
+    return list(zip(*samples))
+
+
+def report(label, values):
+    values = [value * 1000 for value in values]
+    print(f"{label:<48} median {statistics.median(values):8.1f} ms   max {max(values):8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"Worker cold start ({args.runs} runs)")
+    create, first_request = run(COLD_START, args.runs)
+    report('import + create_app', create)
+    report('first authenticated request', first_request)
+
+    if hasattr(os, 'fork'):
+        (forked,) = run(FORKED_START, args.runs)
+        report('preloaded fork + first authenticated request', forked)
+
+    print("Heartbeat ingestion (2000 pings from 200 stations)")
+    per_ping, commits = run(HEARTBEAT_INGEST, 1)
+    report('per ping', per_ping)
+    print(f"{'database commits':<48} {int(commits[0]):8d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import io
+import multiprocessing
+
+from flask import current_app, request
+
+# Hashing a handful of passwords inline is faster than handing them to the pool
+MIN_PARALLEL_HASHES = 8
+
+
+class BulkInputError(ValueError):
+    pass
+
+
+def parse_rows(key, scalar_field=None):
+    """Read bulk rows from a JSON body ({key: [...]} or a bare list), a CSV body or an uploaded CSV file.
+
+    With scalar_field, a JSON list of plain values such as [1, 2, 3] is accepted
+    and each value becomes {scalar_field: value}.
+    """
+    if 'file' in request.files:
+        try:
+            text = request.files['file'].read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise BulkInputError('Uploaded CSV must be UTF-8 encoded')
+        rows = list(csv.DictReader(io.StringIO(text)))
+    elif request.mimetype == 'text/csv':
+        rows = list(csv.DictReader(io.StringIO(request.get_data(as_text=True))))
+    else:
+        data = request.get_json(silent=True)
+        rows = data.get(key) if isinstance(data, dict) else data
+
+    if not isinstance(rows, list) or not rows:
+        raise BulkInputError(f'Provide a non-empty list of {key} as JSON or CSV')
+
+    max_rows = current_app.config['BULK_MAX_ROWS']
+    if len(rows) > max_rows:
+        raise BulkInputError(f'At most {max_rows} rows can be processed per request')
+
+    if scalar_field:
+        rows = [row if isinstance(row, dict) else {scalar_field: row} for row in rows]
+
+    if not all(isinstance(row, dict) for row in rows):
+        raise BulkInputError('Each row must be an object')
+
+    return rows
+
+
+def parse_bool(value):
+    # CSV cells arrive as strings
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def hash_passwords(passwords):
+    """Hash passwords in parallel over a process pool, keeping their order.
+
+    The pool only lives for the call, so idle gunicorn workers don't each keep
+    BULK_HASH_WORKERS interpreters around between imports.
+    """
+    from werkzeug.security import generate_password_hash
+
+    workers = min(current_app.config['BULK_HASH_WORKERS'], len(passwords) // MIN_PARALLEL_HASHES)
+    if workers <= 1:
+        return [generate_password_hash(password) for password in passwords]
+
+    chunksize = max(1, len(passwords) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return list(pool.map(generate_password_hash, passwords, chunksize=chunksize))
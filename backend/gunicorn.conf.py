@@ -0,0 +1,20 @@
+# Gunicorn settings: gunicorn -c gunicorn.conf.py
+import multiprocessing
+import os
+
+wsgi_app = "wsgi:app"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+
+# Build the app once in the master; workers fork with its modules already loaded
+# and share those pages copy-on-write instead of importing everything again
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared with forked workers
+    from app import db
+    from wsgi import app
+
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,96 @@
+from datetime import datetime
+from threading import Lock, Thread
+import atexit
+import os
+import time
+
+from sqlalchemy.dialects.sqlite import insert
+
+from app import db
+from models import Machine, MachineHeartbeat
+
+
+class HeartbeatBuffer:
+    """Coalesces station pings in memory and writes them to the database in batches.
+
+    Only the latest ping per machine is kept, so a flush costs one upsert
+    statement and one commit no matter how often the stations ping.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = Lock()
+        self._flusher_pid = None
+
+    def record(self, machine_id, state=None, seen_at=None):
+        with self._lock:
+            self._pending[machine_id] = (seen_at or datetime.utcnow(), state)
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def flush(self):
+        """Write buffered pings for known machines. Needs an app context."""
+        pending = self.drain()
+        if not pending:
+            return 0
+
+        try:
+            # Drop pings from ids that don't belong to a machine
+            known = {
+                machine_id for (machine_id,) in
+                db.session.query(Machine.id).filter(Machine.id.in_(list(pending))).all()
+            }
+            rows = [
+                {'machine_id': machine_id, 'last_seen': seen_at, 'reported_state': state}
+                for machine_id, (seen_at, state) in pending.items()
+                if machine_id in known
+            ]
+            if not rows:
+                return 0
+
+            statement = insert(MachineHeartbeat)
+            statement = statement.on_conflict_do_update(
+                index_elements=[MachineHeartbeat.machine_id],
+                set_={
+                    'last_seen': statement.excluded.last_seen,
+                    'reported_state': statement.excluded.reported_state
+                }
+            )
+            db.session.execute(statement, rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Put the pings back unless a newer one arrived meanwhile
+            with self._lock:
+                for machine_id, value in pending.items():
+                    self._pending.setdefault(machine_id, value)
+            raise
+        return len(rows)
+
+    def start(self, app):
+        """Start the background flusher once per process (gunicorn workers fork after preload)."""
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+
+        interval = app.config['HEARTBEAT_FLUSH_SECONDS']
+
+        def run():
+            while True:
+                time.sleep(interval)
+                with app.app_context():
+                    try:
+                        self.flush()
+                    except Exception as e:
+                        app.logger.warning(f'Heartbeat flush failed: {e}')
+
+        def flush_on_exit():
+            with app.app_context():
+                self.flush()
+
+        Thread(target=run, name='heartbeat-flusher', daemon=True).start()
+        atexit.register(flush_on_exit)
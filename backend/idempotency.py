@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta
+from functools import wraps
+import hashlib
+
+from flask import current_app, jsonify, make_response, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import IdempotencyKey
+
+
+class IdempotencyStore:
+    """Recent Idempotency-Key values and their responses, kept in the database.
+
+    Every gunicorn worker sees the same rows, so a retry is recognised whichever
+    worker it lands on. The row is inserted before the handler runs, and the
+    unique constraint on the key marks it pending so a concurrent retry can't
+    run the same write twice. Rows expire after a TTL and the oldest are
+    removed once there are more than max_entries.
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+    def _purge(self, newest_id):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        IdempotencyKey.query.filter(
+            db.or_(
+                IdempotencyKey.created_at < cutoff,
+                IdempotencyKey.id <= newest_id - self.max_entries
+            )
+        ).delete(synchronize_session=False)
+
+    def reserve(self, scope, fingerprint):
+        """Claim a key for a new request.
+
+        Returns None if the caller should run the request, otherwise the
+        existing IdempotencyKey row (status_code is None while it is pending).
+        """
+        identity, method, path, key = scope
+        while True:
+            entry = IdempotencyKey(
+                identity=identity, method=method, path=path, key=key, fingerprint=fingerprint
+            )
+            try:
+                db.session.add(entry)
+                db.session.flush()
+                self._purge(entry.id)
+                db.session.commit()
+                return None
+            except IntegrityError:
+                db.session.rollback()
+
+            existing = IdempotencyKey.query.filter_by(
+                identity=identity, method=method, path=path, key=key
+            ).first()
+            if existing is None:
+                # Purged between our insert and the lookup: try to claim it again
+                continue
+
+            cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+            if existing.created_at < cutoff:
+                # Expired but not purged yet: start over with a fresh claim
+                db.session.delete(existing)
+                db.session.commit()
+                continue
+            return existing
+
+    def complete(self, scope, response):
+        identity, method, path, key = scope
+        IdempotencyKey.query.filter_by(
+            identity=identity, method=method, path=path, key=key
+        ).update({
+            'status_code': response.status_code,
+            'body': response.get_data(),
+            'content_type': response.content_type
+        }, synchronize_session=False)
+        db.session.commit()
+
+    def release(self, scope):
+        identity, method, path, key = scope
+        db.session.rollback()
+        IdempotencyKey.query.filter_by(
+            identity=identity, method=method, path=path, key=key
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def idempotent():
+    """Replay the stored response when a request repeats its Idempotency-Key header.
+
+    Keys are scoped to the caller and the route. Successful and client-error
+    responses are stored; server errors are not, so the client can retry them.
+    """
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            if not key:
+                return fn(*args, **kwargs)
+
+            if len(key) > 255:
+                return jsonify({'message': 'Idempotency-Key must be at most 255 characters'}), 400
+
+            store = current_app.extensions['idempotency']
+            scope = (str(get_jwt_identity()), request.method, request.path, key)
+            fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+            existing = store.reserve(scope, fingerprint)
+            if existing is not None:
+                if existing.fingerprint != fingerprint:
+                    return jsonify({'message': 'Idempotency-Key was already used with a different request body'}), 422
+                if existing.status_code is None:
+                    return jsonify({'message': 'A request with this Idempotency-Key is still being processed'}), 409
+                response = current_app.response_class(
+                    existing.body, status=existing.status_code, content_type=existing.content_type
+                )
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+
+            try:
+                response = make_response(fn(*args, **kwargs))
+            except Exception:
+                store.release(scope)
+                raise
+
+            if response.status_code >= 500:
+                store.release(scope)
+            else:
+                store.complete(scope, response)
+            return response
+        return decorator
+    return wrapper
@@ -1,7 +1,6 @@
 from app import db
 from sqlalchemy.orm import relationship
-from datetime import datetime
-from pytz import timezone
+from datetime import datetime, timezone as dt_timezone
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -12,14 +11,18 @@ class User(db.Model):
     gender = db.Column(db.String(10), default="male", nullable=True)  # "male", "female", or "other"
     img_url = db.Column(db.String(200), nullable=True)  # URL to avatar image
     
+    # Never reuse a deleted user's id, archived history is keyed by it
+    __table_args__ = {'sqlite_autoincrement': True}
+    
     # Relationships
     sessions = relationship("Session", back_populates="user")
+    stats = relationship("UserStats", uselist=False, cascade="all, delete-orphan")
     
     def __repr__(self):
         return f'<User {self.username}>'
         
-    def to_json(self):
-        return {
+    def to_json(self, include_stats=False):
+        data = {
             "id": self.id,
             "username": self.username,
             "is_admin": self.is_admin,
@@ -27,6 +30,9 @@ class User(db.Model):
             "gender": self.gender,
             "img_url": self.img_url
         }
+        if include_stats:
+            data["stats"] = self.stats.to_json() if self.stats else UserStats.empty_json()
+        return data
 
 class Machine(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -37,14 +43,32 @@ class Machine(db.Model):
     
     # Relationships
     sessions = relationship("Session", back_populates="machine")
+    heartbeat = relationship("MachineHeartbeat", uselist=False, lazy="joined", cascade="all, delete-orphan")
+    
+    @property
+    def health(self):
+        """Derived from the station's last heartbeat: unknown, online, offline or error."""
+        if not self.heartbeat or not self.heartbeat.last_seen:
+            return "unknown"
+        from flask import current_app
+        timeout = current_app.config.get("HEARTBEAT_TIMEOUT_SECONDS", 30)
+        if (datetime.utcnow() - self.heartbeat.last_seen).total_seconds() > timeout:
+            return "offline"
+        if self.heartbeat.reported_state not in (None, "ok"):
+            return "error"
+        return "online"
     
     def to_json(self):
+        from pytz import timezone
+        last_seen = self.heartbeat.last_seen if self.heartbeat else None
         return {
             "id": self.id,
             "name": self.name,
             "machine_type": self.machine_type,
             "hourly_rate": self.hourly_rate,
-            "status": self.status
+            "status": self.status,
+            "health": self.health,
+            "last_seen": last_seen.replace(tzinfo=dt_timezone.utc).astimezone(timezone('Asia/Kolkata')).isoformat() if last_seen else None
         }
 
 class Session(db.Model):
@@ -63,6 +87,7 @@ class Session(db.Model):
     
     def to_json(self):
         # Create local timezone object for Asia/Kolkata (Indian Standard Time)
+        from pytz import timezone
         local_tz = timezone('Asia/Kolkata')
         
         # Convert start_time to local timezone
@@ -128,4 +153,217 @@ class Transaction(db.Model):
             "description": self.description,
             "timestamp": self.timestamp.isoformat() if self.timestamp else None,
             "session_id": self.session_id
-        }
\ No newline at end of file
+        }
+
+
+class Reservation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    machine_id = db.Column(db.Integer, db.ForeignKey('machine.id'), nullable=False, index=True)
+    start_time = db.Column(db.DateTime, nullable=False)  # UTC
+    end_time = db.Column(db.DateTime, nullable=False)  # UTC
+    status = db.Column(db.String(20), default="Booked")  # Booked, Fulfilled, Cancelled
+    group_id = db.Column(db.String(36), nullable=True, index=True)  # Shared by machines booked together
+    note = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    user = relationship("User")
+    machine = relationship("Machine")
+    
+    __table_args__ = (
+        db.Index('ix_reservation_machine_window', 'machine_id', 'status', 'start_time', 'end_time'),
+    )
+    
+    def to_json(self):
+        # Reservations are stored in UTC and shown in Asia/Kolkata like sessions
+        from pytz import timezone
+        local_tz = timezone('Asia/Kolkata')
+        from datetime import timezone as dt_timezone
+        
+        def to_local(value):
+            if value is None:
+                return None
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=dt_timezone.utc)
+            return value.astimezone(local_tz).isoformat()
+        
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "username": self.user.username if self.user else None,
+            "machine_id": self.machine_id,
+            "machine_name": self.machine.name if self.machine else None,
+            "machine_type": self.machine.machine_type if self.machine else None,
+            "start_time": to_local(self.start_time),
+            "end_time": to_local(self.end_time),
+            "status": self.status,
+            "group_id": self.group_id,
+            "note": self.note
+        }
+
+class ScheduleVersion(db.Model):
+    """Single-row counter bumped by every reservation write, so each worker knows when its schedule cache is stale."""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class ArchiveSummary(db.Model):
+    """Monthly per-user totals for sessions and transactions moved to the archive."""
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(7), nullable=False, index=True)  # YYYY-MM
+    user_id = db.Column(db.Integer, nullable=True)  # No foreign key: set to NULL when the user is deleted so totals survive
+    sessions_count = db.Column(db.Integer, default=0)
+    hours = db.Column(db.Float, default=0.0)
+    session_revenue = db.Column(db.Float, default=0.0)
+    deposits = db.Column(db.Float, default=0.0)
+    last_visit = db.Column(db.DateTime, nullable=True)  # Latest archived session end in this month (UTC)
+    
+    __table_args__ = (
+        db.UniqueConstraint('month', 'user_id', name='uq_archive_summary_month_user'),
+    )
+    
+    def to_json(self):
+        return {
+            "month": self.month,
+            "user_id": self.user_id,
+            "sessions_count": self.sessions_count,
+            "hours": self.hours,
+            "session_revenue": self.session_revenue,
+            "deposits": self.deposits,
+            "last_visit": self.last_visit.isoformat() if self.last_visit else None
+        }
+
+class UserStats(db.Model):
+    """Running per-user totals, updated when sessions end and balance is added."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    sessions_count = db.Column(db.Integer, default=0)
+    hours_played = db.Column(db.Float, default=0.0)
+    total_spent = db.Column(db.Float, default=0.0)
+    total_deposited = db.Column(db.Float, default=0.0)
+    last_visit = db.Column(db.DateTime, nullable=True)  # End of the latest session (UTC)
+    
+    @classmethod
+    def for_user(cls, user_id):
+        """Return the stats row for a user, building it from history the first time."""
+        stats = cls.query.get(user_id)
+        if stats is None:
+            stats = cls.backfill([user_id])[user_id]
+        return stats
+    
+    @classmethod
+    def backfill(cls, user_ids):
+        """Create stats rows for users that have none, using grouped queries over their history."""
+        user_ids = list(user_ids)
+        rows = {
+            user_id: cls(
+                user_id=user_id, sessions_count=0, hours_played=0.0,
+                total_spent=0.0, total_deposited=0.0
+            )
+            for user_id in user_ids
+        }
+        if not rows:
+            return rows
+        
+        sessions = db.session.query(
+            Session.user_id,
+            db.func.count(Session.id),
+            db.func.sum(Session.duration),
+            db.func.max(Session.end_time)
+        ).filter(
+            Session.user_id.in_(user_ids),
+            Session.is_active == False
+        ).group_by(Session.user_id).all()
+        
+        for user_id, sessions_count, hours, last_visit in sessions:
+            rows[user_id].sessions_count += sessions_count or 0
+            rows[user_id].hours_played += hours or 0.0
+            rows[user_id].last_visit = last_visit
+        
+        transactions = db.session.query(
+            Transaction.user_id,
+            Transaction.transaction_type,
+            db.func.sum(Transaction.amount)
+        ).filter(
+            Transaction.user_id.in_(user_ids)
+        ).group_by(Transaction.user_id, Transaction.transaction_type).all()
+        
+        for user_id, transaction_type, amount in transactions:
+            if transaction_type == 'session_charge':
+                rows[user_id].total_spent += abs(amount or 0)
+            elif transaction_type == 'deposit':
+                rows[user_id].total_deposited += amount or 0
+        
+        # History that has already been moved to the archive
+        archived = db.session.query(
+            ArchiveSummary.user_id,
+            db.func.sum(ArchiveSummary.sessions_count),
+            db.func.sum(ArchiveSummary.hours),
+            db.func.sum(ArchiveSummary.session_revenue),
+            db.func.sum(ArchiveSummary.deposits),
+            db.func.max(ArchiveSummary.last_visit)
+        ).filter(
+            ArchiveSummary.user_id.in_(user_ids)
+        ).group_by(ArchiveSummary.user_id).all()
+        
+        for user_id, sessions_count, hours, session_revenue, deposits, last_visit in archived:
+            if last_visit and (rows[user_id].last_visit is None or last_visit > rows[user_id].last_visit):
+                rows[user_id].last_visit = last_visit
+            rows[user_id].sessions_count += sessions_count or 0
+            rows[user_id].hours_played += hours or 0.0
+            rows[user_id].total_spent += session_revenue or 0.0
+            rows[user_id].total_deposited += deposits or 0.0
+        
+        db.session.add_all(rows.values())
+        return rows
+    
+    def record_session(self, session):
+        self.sessions_count += 1
+        self.hours_played += session.duration or 0.0
+        self.total_spent += session.amount_charged or 0.0
+        self.last_visit = session.end_time
+    
+    def record_deposit(self, amount):
+        self.total_deposited += amount
+    
+    @staticmethod
+    def empty_json():
+        return {
+            "sessions_count": 0,
+            "hours_played": 0.0,
+            "total_spent": 0.0,
+            "total_deposited": 0.0,
+            "last_visit": None
+        }
+    
+    def to_json(self):
+        from pytz import timezone
+        return {
+            "sessions_count": self.sessions_count,
+            "hours_played": self.hours_played,
+            "total_spent": self.total_spent,
+            "total_deposited": self.total_deposited,
+            "last_visit": self.last_visit.replace(tzinfo=dt_timezone.utc).astimezone(timezone('Asia/Kolkata')).isoformat() if self.last_visit else None
+        }
+
+class MachineHeartbeat(db.Model):
+    """Latest ping from a station, written in batches by the heartbeat flusher."""
+    machine_id = db.Column(db.Integer, db.ForeignKey('machine.id'), primary_key=True)
+    last_seen = db.Column(db.DateTime, nullable=False)  # UTC
+    reported_state = db.Column(db.String(20), nullable=True)  # "ok" or an error reported by the station
+
+class IdempotencyKey(db.Model):
+    """A recent Idempotency-Key and the response it produced, shared by every worker."""
+    id = db.Column(db.Integer, primary_key=True)
+    identity = db.Column(db.String(80), nullable=False)  # JWT identity of the caller
+    method = db.Column(db.String(10), nullable=False)
+    path = db.Column(db.String(200), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # SHA-256 of the request body
+    status_code = db.Column(db.Integer, nullable=True)  # NULL while the first request is running
+    body = db.Column(db.LargeBinary, nullable=True)
+    content_type = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('identity', 'method', 'path', 'key', name='uq_idempotency_key_scope'),
+    )
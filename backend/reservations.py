@@ -0,0 +1,178 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from threading import Lock
+import time
+
+from flask import current_app, g
+from sqlalchemy.dialects.sqlite import insert
+
+from app import db
+from models import Reservation, ScheduleVersion
+
+# Reservation writes bump ScheduleVersion, which is how a worker notices
+# bookings made by the others. The TTL only catches changes made outside the app.
+INDEX_TTL_SECONDS = 30
+
+
+class MachineSchedule:
+    """Sorted interval index of the booked reservations on one machine.
+
+    Bookings on a machine never overlap, so ordering them by start time also
+    orders them by end time. That lets both conflict checks and window queries
+    run as binary searches instead of scans over the whole day.
+    """
+
+    def __init__(self, entries=()):
+        self.starts = []
+        self.ends = []
+        self.ids = []
+        for start, end, reservation_id in sorted(entries):
+            self.starts.append(start)
+            self.ends.append(end)
+            self.ids.append(reservation_id)
+        self.loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _window(self, start, end):
+        # Entries [lo, hi) are the ones with end > start and start < end
+        lo = bisect_right(self.ends, start)
+        hi = bisect_left(self.starts, end)
+        return lo, hi
+
+    def overlapping(self, start, end):
+        """Return (start, end, reservation_id) for bookings overlapping [start, end)."""
+        lo, hi = self._window(start, end)
+        return [(self.starts[i], self.ends[i], self.ids[i]) for i in range(lo, hi)]
+
+    def is_free(self, start, end):
+        lo, hi = self._window(start, end)
+        return lo >= hi
+
+    def add(self, start, end, reservation_id):
+        index = bisect_left(self.starts, start)
+        self.starts.insert(index, start)
+        self.ends.insert(index, end)
+        self.ids.insert(index, reservation_id)
+
+    def remove(self, reservation_id):
+        if reservation_id in self.ids:
+            index = self.ids.index(reservation_id)
+            del self.starts[index]
+            del self.ends[index]
+            del self.ids[index]
+
+    def free_slots(self, start, end):
+        """Return the gaps between bookings inside [start, end)."""
+        slots = []
+        cursor = start
+        for booked_start, booked_end, _ in self.overlapping(start, end):
+            if booked_start > cursor:
+                slots.append((cursor, booked_start))
+            cursor = max(cursor, booked_end)
+        if cursor < end:
+            slots.append((cursor, end))
+        return slots
+
+
+class ReservationIndex:
+    """Per-app cache of machine schedules, registered on app.extensions['reservations'].
+
+    The cache is dropped whenever the shared ScheduleVersion moves past the
+    version it was loaded at, so one worker never serves another's stale bookings.
+    """
+
+    def __init__(self):
+        self._schedules = {}
+        self._version = None
+        self._lock = Lock()
+
+    def sync(self):
+        """Drop the cached schedules if another worker changed a reservation since they were loaded."""
+        version = db.session.query(ScheduleVersion.version).filter_by(id=1).scalar() or 0
+        with self._lock:
+            if version != self._version:
+                self._schedules.clear()
+                self._version = version
+
+    def bump(self):
+        """Bump the shared version inside the caller's transaction. Call before committing a reservation change."""
+        statement = insert(ScheduleVersion).values(id=1, version=1)
+        statement = statement.on_conflict_do_update(
+            index_elements=[ScheduleVersion.id],
+            set_={'version': ScheduleVersion.version + 1}
+        )
+        db.session.execute(statement)
+        version = db.session.query(ScheduleVersion.version).filter_by(id=1).scalar()
+        with self._lock:
+            # Our own change is applied to the cache by the caller; anything in
+            # between came from another worker and needs a reload
+            if self._version != version - 1:
+                self._schedules.clear()
+            self._version = version
+
+    def get_schedule(self, machine_id):
+        """Return the cached schedule for a machine, loading it if missing or stale."""
+        with self._lock:
+            schedule = self._schedules.get(machine_id)
+            if schedule is None or time.monotonic() - schedule.loaded_at > INDEX_TTL_SECONDS:
+                schedule = _load_schedule(machine_id)
+                self._schedules[machine_id] = schedule
+            return schedule
+
+    def record_booking(self, reservation):
+        with self._lock:
+            schedule = self._schedules.get(reservation.machine_id)
+            if schedule is not None:
+                schedule.add(reservation.start_time, reservation.end_time, reservation.id)
+
+    def release_booking(self, reservation):
+        with self._lock:
+            schedule = self._schedules.get(reservation.machine_id)
+            if schedule is not None:
+                schedule.remove(reservation.id)
+
+    def invalidate(self, machine_id=None):
+        with self._lock:
+            if machine_id is None:
+                self._schedules.clear()
+            else:
+                self._schedules.pop(machine_id, None)
+
+
+def _load_schedule(machine_id):
+    rows = Reservation.query.with_entities(
+        Reservation.start_time, Reservation.end_time, Reservation.id
+    ).filter(
+        Reservation.machine_id == machine_id,
+        Reservation.status == 'Booked',
+        Reservation.end_time > datetime.utcnow()
+    ).all()
+    return MachineSchedule((row.start_time, row.end_time, row.id) for row in rows)
+
+
+# Shortcuts for the current app's index
+def get_schedule(machine_id):
+    index = current_app.extensions['reservations']
+    # One version check per request is enough to see other workers' writes
+    if not g.get('reservations_synced'):
+        index.sync()
+        g.reservations_synced = True
+    return index.get_schedule(machine_id)
+
+
+def bump():
+    current_app.extensions['reservations'].bump()
+
+
+def record_booking(reservation):
+    current_app.extensions['reservations'].record_booking(reservation)
+
+
+def release_booking(reservation):
+    current_app.extensions['reservations'].release_booking(reservation)
+
+
+def invalidate(machine_id=None):
+    current_app.extensions['reservations'].invalidate(machine_id)
@@ -1,11 +1,20 @@
-from flask import request, jsonify
-from app import app, db
-from models import User, Machine, Session, Transaction
+from flask import Blueprint, current_app, request, jsonify
+from app import db
+from models import User, Machine, Session, Transaction, Reservation, ArchiveSummary, UserStats
 from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required, get_jwt
-from werkzeug.security import check_password_hash, generate_password_hash
-from datetime import datetime, timedelta
+from sqlalchemy.orm import joinedload
+from datetime import datetime, timedelta, timezone as dt_timezone
 from functools import wraps
+import hmac
 import math
+import re
+import uuid
+import archive
+import bulk
+import reservations
+from idempotency import idempotent
+
+api = Blueprint('api', __name__)
 
 # Admin decorator
 def admin_required():
@@ -21,8 +30,15 @@ def admin_required():
         return decorator
     return wrapper
 
+def avatar_url(username, gender):
+    if gender == "male":
+        return f"https://avatar.iran.liara.run/public/boy?username={username}"
+    elif gender == "female":
+        return f"https://avatar.iran.liara.run/public/girl?username={username}"
+    return None
+
 # Authentication routes
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     data = request.get_json()
     username = data.get('username')
@@ -31,6 +47,8 @@ def login():
     if not username or not password:
         return jsonify({'message': 'Username and password are required'}), 400
         
+    from werkzeug.security import check_password_hash
+    
     user = User.query.filter_by(username=username).first()
     
     if not user:
@@ -51,7 +69,7 @@ def login():
         
     return jsonify({'message': 'Incorrect password'}), 401
 
-@app.route('/api/signup', methods=['POST'])
+@api.route('/api/signup', methods=['POST'])
 def signup():
     try:
         data = request.get_json()
@@ -70,14 +88,11 @@ def signup():
             return jsonify({'message': 'Username already exists', 'success': False}), 400
             
         # Hash the password properly
+        from werkzeug.security import generate_password_hash
         hashed_password = generate_password_hash(password)
         
         # Generate avatar URL based on gender
-        img_url = None
-        if gender == "male":
-            img_url = f"https://avatar.iran.liara.run/public/boy?username={username}"
-        elif gender == "female":
-            img_url = f"https://avatar.iran.liara.run/public/girl?username={username}"
+        img_url = avatar_url(username, gender)
         
         # Create the user with the appropriate admin status
         new_user = User(
@@ -109,17 +124,32 @@ def signup():
         return jsonify({'message': f'Error creating user: {str(e)}', 'success': False}), 500
 
 # User routes
-@app.route('/api/users', methods=['GET'])
+@api.route('/api/users', methods=['GET'])
 @jwt_required()
 @admin_required()
 def get_users():
-    users = User.query.all()
+    include_stats = 'stats' in request.args.get('include', '').split(',')
+    
+    if include_stats:
+        # Stats are joined in so the list stays a single query
+        users = User.query.options(joinedload(User.stats)).all()
+        
+        missing = [user.id for user in users if user.stats is None]
+        if missing:
+            backfilled = UserStats.backfill(missing)
+            db.session.commit()
+            for user in users:
+                if user.id in backfilled:
+                    user.stats = backfilled[user.id]
+    else:
+        users = User.query.all()
+    
     return jsonify({
-        'users': [user.to_json() for user in users],
+        'users': [user.to_json(include_stats=include_stats) for user in users],
         'count': len(users)
     })
 
-@app.route('/api/users/<int:id>', methods=['GET'])
+@api.route('/api/users/<int:id>', methods=['GET'])
 @jwt_required()
 def get_user(id):
     current_user_id = get_jwt_identity()
@@ -132,12 +162,18 @@ def get_user(id):
     user = User.query.get(id)
     if not user:
         return jsonify({'message': 'User not found'}), 404
+    
+    include_stats = 'stats' in request.args.get('include', '').split(',')
+    if include_stats and user.stats is None:
+        UserStats.for_user(user.id)
+        db.session.commit()
         
-    return jsonify({'user': user.to_json()})
+    return jsonify({'user': user.to_json(include_stats=include_stats)})
 
-@app.route('/api/users/<int:id>/add-balance', methods=['POST'])
+@api.route('/api/users/<int:id>/add-balance', methods=['POST'])
 @jwt_required()
 @admin_required()
+@idempotent()
 def add_balance(id):
     try:
         data = request.get_json()
@@ -150,8 +186,12 @@ def add_balance(id):
         if not user:
             return jsonify({'message': 'User not found'}), 404
             
+        # Load stats before the new transaction exists so a first-time backfill doesn't count it
+        stats = UserStats.for_user(user.id)
+        
         # Update user balance
         user.balance += amount
+        stats.record_deposit(amount)
         
         # Create transaction record
         transaction = Transaction(
@@ -174,7 +214,7 @@ def add_balance(id):
         db.session.rollback()
         return jsonify({'message': f'Error adding balance: {str(e)}'}), 500
 
-@app.route('/api/users/<int:id>', methods=['DELETE'])
+@api.route('/api/users/<int:id>', methods=['DELETE'])
 @jwt_required()
 @admin_required()
 def delete_user(id):
@@ -206,6 +246,13 @@ def delete_user(id):
             if machine:
                 machine.status = 'Available'
         
+        # Delete reservations
+        Reservation.query.filter_by(user_id=id).delete()
+        reservations.bump()
+        
+        # Keep archived totals but detach them from this id
+        archive.forget_users([id])
+        
         # Delete transactions
         Transaction.query.filter_by(user_id=id).delete()
         
@@ -216,14 +263,243 @@ def delete_user(id):
         db.session.delete(user)
         db.session.commit()
         
+        reservations.invalidate()
+        
         return jsonify({'message': 'User deleted successfully'}), 200
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'Error deleting user: {str(e)}'}), 500
 
+# Bulk user routes
+@api.route('/api/users/bulk', methods=['POST'])
+@jwt_required()
+@admin_required()
+@idempotent()
+def bulk_create_users():
+    try:
+        rows = bulk.parse_rows('users')
+    except bulk.BulkInputError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    errors = []
+    valid = []
+    seen = set()
+    
+    for index, row in enumerate(rows):
+        username = row.get('username') or ''
+        password = row.get('password') or ''
+        gender = row.get('gender') or 'male'
+        
+        if not all(isinstance(value, str) for value in (username, password, gender)):
+            errors.append({'row': index, 'username': username, 'message': 'Username, password and gender must be text'})
+            continue
+        
+        username = username.strip()
+        gender = gender.strip()
+        
+        if not username or not password:
+            errors.append({'row': index, 'username': username, 'message': 'Username and password are required'})
+        elif len(username) > 80:
+            errors.append({'row': index, 'username': username, 'message': 'Username must be at most 80 characters'})
+        elif gender not in ('male', 'female', 'other'):
+            errors.append({'row': index, 'username': username, 'message': 'Gender must be male, female or other'})
+        elif username in seen:
+            errors.append({'row': index, 'username': username, 'message': 'Username appears more than once in this import'})
+        else:
+            seen.add(username)
+            valid.append((index, username, password, gender, bulk.parse_bool(row.get('is_admin', False))))
+    
+    # One query for every username already taken
+    taken = {
+        username for (username,) in
+        db.session.query(User.username).filter(User.username.in_([row[1] for row in valid])).all()
+    } if valid else set()
+    
+    to_create = []
+    for row in valid:
+        if row[1] in taken:
+            errors.append({'row': row[0], 'username': row[1], 'message': 'Username already exists'})
+        else:
+            to_create.append(row)
+    
+    try:
+        hashed_passwords = bulk.hash_passwords([row[2] for row in to_create])
+        
+        new_users = [
+            User(
+                username=username,
+                password=hashed_password,
+                is_admin=is_admin,
+                gender=gender,
+                img_url=avatar_url(username, gender),
+                balance=0.0
+            )
+            for (_, username, _, gender, is_admin), hashed_password in zip(to_create, hashed_passwords)
+        ]
+        
+        # All rows go in together
+        db.session.add_all(new_users)
+        db.session.commit()
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Error creating users: {str(e)}'}), 500
+    
+    return jsonify({
+        'message': f'Created {len(new_users)} of {len(rows)} users',
+        'users': [user.to_json() for user in new_users],
+        'errors': sorted(errors, key=lambda error: error['row']),
+        'created': len(new_users),
+        'failed': len(errors)
+    }), 201 if new_users else 400
+
+@api.route('/api/users/bulk/add-balance', methods=['POST'])
+@jwt_required()
+@admin_required()
+@idempotent()
+def bulk_add_balance():
+    try:
+        rows = bulk.parse_rows('balances')
+    except bulk.BulkInputError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    errors = []
+    valid = []
+    
+    for index, row in enumerate(rows):
+        try:
+            user_id = int(row.get('user_id'))
+            amount = float(row.get('amount', 0))
+        except (TypeError, ValueError):
+            errors.append({'row': index, 'user_id': row.get('user_id'), 'message': 'User ID and numeric amount are required'})
+            continue
+        
+        if not math.isfinite(amount):
+            errors.append({'row': index, 'user_id': user_id, 'message': 'Amount must be a finite number'})
+        elif amount <= 0:
+            errors.append({'row': index, 'user_id': user_id, 'message': 'Amount must be greater than zero'})
+        else:
+            valid.append((index, user_id, amount))
+    
+    try:
+        user_ids = {user_id for _, user_id, _ in valid}
+        users = {
+            user.id: user for user in
+            User.query.options(joinedload(User.stats)).filter(User.id.in_(user_ids)).all()
+        } if user_ids else {}
+        
+        # Stats are built before the new transactions exist so a backfill doesn't count them
+        missing_stats = UserStats.backfill([user.id for user in users.values() if user.stats is None])
+        for user_id, stats in missing_stats.items():
+            users[user_id].stats = stats
+        
+        transactions = []
+        for index, user_id, amount in valid:
+            user = users.get(user_id)
+            if not user:
+                errors.append({'row': index, 'user_id': user_id, 'message': 'User not found'})
+                continue
+            
+            user.balance += amount
+            user.stats.record_deposit(amount)
+            transactions.append(Transaction(
+                user_id=user.id,
+                amount=amount,
+                transaction_type='deposit',
+                description='Balance added by admin (bulk)'
+            ))
+        
+        db.session.add_all(transactions)
+        db.session.commit()
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Error adding balance: {str(e)}'}), 500
+    
+    return jsonify({
+        'message': f'Added balance for {len(transactions)} of {len(rows)} rows',
+        'transactions': [transaction.to_json() for transaction in transactions],
+        'errors': sorted(errors, key=lambda error: error['row']),
+        'updated': len(transactions),
+        'failed': len(errors)
+    }), 200 if transactions else 400
+
+@api.route('/api/users/bulk/delete', methods=['POST'])
+@jwt_required()
+@admin_required()
+def bulk_delete_users():
+    try:
+        rows = bulk.parse_rows('user_ids', scalar_field='user_id')
+    except bulk.BulkInputError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    current_user_id = int(get_jwt_identity())
+    errors = []
+    requested = []
+    
+    for index, row in enumerate(rows):
+        try:
+            user_id = int(row.get('user_id'))
+        except (TypeError, ValueError):
+            errors.append({'row': index, 'user_id': row.get('user_id'), 'message': 'User ID is required'})
+            continue
+        
+        if user_id == current_user_id:
+            errors.append({'row': index, 'user_id': user_id, 'message': 'You cannot delete your own account'})
+        else:
+            requested.append((index, user_id))
+    
+    try:
+        existing = {
+            user_id for (user_id,) in
+            db.session.query(User.id).filter(User.id.in_([user_id for _, user_id in requested])).all()
+        } if requested else set()
+        
+        for index, user_id in requested:
+            if user_id not in existing:
+                errors.append({'row': index, 'user_id': user_id, 'message': 'User not found'})
+        
+        user_ids = list(existing)
+        if user_ids:
+            # Free the machines of any active sessions
+            machine_ids = [
+                machine_id for (machine_id,) in
+                db.session.query(Session.machine_id).filter(
+                    Session.user_id.in_(user_ids),
+                    Session.is_active == True
+                ).all()
+            ]
+            if machine_ids:
+                Machine.query.filter(Machine.id.in_(machine_ids)).update(
+                    {'status': 'Available'}, synchronize_session=False
+                )
+            
+            Reservation.query.filter(Reservation.user_id.in_(user_ids)).delete(synchronize_session=False)
+            reservations.bump()
+            archive.forget_users(user_ids)
+            Transaction.query.filter(Transaction.user_id.in_(user_ids)).delete(synchronize_session=False)
+            Session.query.filter(Session.user_id.in_(user_ids)).delete(synchronize_session=False)
+            UserStats.query.filter(UserStats.user_id.in_(user_ids)).delete(synchronize_session=False)
+            User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+            db.session.commit()
+            
+            reservations.invalidate()
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Error deleting users: {str(e)}'}), 500
+    
+    return jsonify({
+        'message': f'Deleted {len(user_ids)} of {len(rows)} users',
+        'deleted_ids': sorted(user_ids),
+        'errors': sorted(errors, key=lambda error: error['row']),
+        'deleted': len(user_ids),
+        'failed': len(errors)
+    }), 200 if user_ids else 400
+
 # Machine routes
-@app.route('/api/machines', methods=['GET'])
+@api.route('/api/machines', methods=['GET'])
 @jwt_required()
 def get_machines():
     machines = Machine.query.all()
@@ -232,7 +508,7 @@ def get_machines():
         'count': len(machines)
     })
 
-@app.route('/api/machines', methods=['POST'])
+@api.route('/api/machines', methods=['POST'])
 @jwt_required()
 @admin_required()
 def create_machine():
@@ -264,7 +540,35 @@ def create_machine():
         db.session.rollback()
         return jsonify({'message': f'Error creating machine: {str(e)}'}), 500
 
-@app.route('/api/machines/<int:id>', methods=['PATCH'])
+@api.route('/api/machines/heartbeat', methods=['POST'])
+def machine_heartbeat():
+    # Stations authenticate with a shared token instead of a user login
+    expected = current_app.config['HEARTBEAT_TOKEN']
+    if not expected:
+        return jsonify({'message': 'Station heartbeats are disabled until HEARTBEAT_TOKEN is set'}), 503
+    
+    token = request.headers.get('X-Station-Token', '')
+    if not hmac.compare_digest(token.encode(), expected.encode()):
+        return jsonify({'message': 'Invalid station token'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        machine_id = int(data.get('machine_id'))
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Machine ID is required'}), 400
+    
+    state = data.get('state')
+    if state is not None and (not isinstance(state, str) or len(state) > 20):
+        return jsonify({'message': 'State must be a short string'}), 400
+    
+    # Pings are buffered and written in batches by the flusher thread
+    heartbeats = current_app.extensions['heartbeats']
+    heartbeats.start(current_app._get_current_object())
+    heartbeats.record(machine_id, state)
+    
+    return jsonify({'message': 'Heartbeat received'}), 202
+
+@api.route('/api/machines/<int:id>', methods=['PATCH'])
 @jwt_required()
 @admin_required()
 def update_machine(id):
@@ -298,7 +602,7 @@ def update_machine(id):
         db.session.rollback()
         return jsonify({'message': f'Error updating machine: {str(e)}'}), 500
 
-@app.route('/api/machines/<int:id>', methods=['DELETE'])
+@api.route('/api/machines/<int:id>', methods=['DELETE'])
 @jwt_required()
 @admin_required()
 def delete_machine(id):
@@ -312,9 +616,13 @@ def delete_machine(id):
         if active_sessions:
             return jsonify({'message': 'Cannot delete machine with active sessions'}), 400
             
+        Reservation.query.filter_by(machine_id=id).delete()
+        reservations.bump()
         db.session.delete(machine)
         db.session.commit()
         
+        reservations.invalidate(id)
+        
         return jsonify({'message': 'Machine deleted successfully'})
         
     except Exception as e:
@@ -322,7 +630,7 @@ def delete_machine(id):
         return jsonify({'message': f'Error deleting machine: {str(e)}'}), 500
 
 # Session routes
-@app.route('/api/sessions', methods=['GET'])
+@api.route('/api/sessions', methods=['GET'])
 @jwt_required()
 def get_sessions():
     current_user_id = get_jwt_identity()
@@ -340,7 +648,7 @@ def get_sessions():
         'count': len(sessions)
     })
 
-@app.route('/api/sessions/active', methods=['GET'])
+@api.route('/api/sessions/active', methods=['GET'])
 @jwt_required()
 def get_active_sessions():
     current_user_id = get_jwt_identity()
@@ -361,9 +669,10 @@ def get_active_sessions():
         'count': len(sessions)
     })
 
-@app.route('/api/sessions', methods=['POST'])
+@api.route('/api/sessions', methods=['POST'])
 @jwt_required()
 @admin_required()
+@idempotent()
 def start_session():
     try:
         data = request.get_json()
@@ -384,6 +693,21 @@ def start_session():
         # Check if machine is available
         if machine.status != 'Available':
             return jsonify({'message': f'Machine {machine.name} is not available'}), 400
+        
+        # Check for bookings that are running now or start within the hold window
+        now = datetime.utcnow()
+        hold_until = now + timedelta(minutes=current_app.config['RESERVATION_HOLD_MINUTES'])
+        claimed_reservation = None
+        
+        # Read the database, not this worker's index, which may miss bookings made elsewhere
+        for reservation in booked_in_window(machine.id, now, hold_until).all():
+            if reservation.user_id == int(user_id):
+                claimed_reservation = reservation
+                continue
+            return jsonify({
+                'message': f'Machine {machine.name} is reserved by another user',
+                'reservation': reservation.to_json()
+            }), 400
             
         # Check if user has enough balance
         if user.balance <= 0:
@@ -396,6 +720,8 @@ def start_session():
         ).first()
         
         if existing_session:
+            stats = UserStats.for_user(user.id)
+            
             # End the existing session
             end_time = datetime.utcnow()
             existing_session.end_time = end_time
@@ -428,6 +754,8 @@ def start_session():
                 session_id=existing_session.id
             )
             
+            stats.record_session(existing_session)
+            
             db.session.add(transaction)
             db.session.commit()
         
@@ -442,9 +770,17 @@ def start_session():
         # Update machine status
         machine.status = 'In Use'
         
+        # The user is taking up their own booking
+        if claimed_reservation:
+            claimed_reservation.status = 'Fulfilled'
+            reservations.bump()
+        
         db.session.add(new_session)
         db.session.commit()
         
+        if claimed_reservation:
+            reservations.release_booking(claimed_reservation)
+        
         # Force refresh the session from database to ensure timestamp is correct
         db.session.refresh(new_session)
         
@@ -457,9 +793,10 @@ def start_session():
         db.session.rollback()
         return jsonify({'message': f'Error starting session: {str(e)}'}), 500
 
-@app.route('/api/sessions/<int:id>/end', methods=['POST'])
+@api.route('/api/sessions/<int:id>/end', methods=['POST'])
 @jwt_required()
 @admin_required()
+@idempotent()
 def end_session(id):
     try:
         session = Session.query.get(id)
@@ -471,6 +808,7 @@ def end_session(id):
             
         user = User.query.get(session.user_id)
         machine = Machine.query.get(session.machine_id)
+        stats = UserStats.for_user(user.id)
         
         # End the session
         end_time = datetime.utcnow()
@@ -507,6 +845,8 @@ def end_session(id):
         # Update machine status
         machine.status = 'Available'
         
+        stats.record_session(session)
+        
         db.session.add(transaction)
         db.session.commit()
         
@@ -520,8 +860,254 @@ def end_session(id):
         db.session.rollback()
         return jsonify({'message': f'Error ending session: {str(e)}'}), 500
 
+# Reservation routes
+def parse_utc_datetime(value):
+    """Parse an ISO timestamp from the client into a naive UTC datetime."""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def booked_in_window(machine_id, start_time, end_time):
+    """Query the Booked reservations on a machine that overlap [start_time, end_time)."""
+    return Reservation.query.filter(
+        Reservation.machine_id == machine_id,
+        Reservation.status == 'Booked',
+        Reservation.start_time < end_time,
+        Reservation.end_time > start_time
+    )
+
+def has_booking_conflict(machine_id, start_time, end_time):
+    # A free slot in the index needs no query: the re-check after flush in
+    # create_reservation is what actually guards against double booking
+    if reservations.get_schedule(machine_id).is_free(start_time, end_time):
+        return False
+    
+    # A hit may be a booking cancelled since the index was loaded, so confirm it
+    if booked_in_window(machine_id, start_time, end_time).first() is not None:
+        return True
+    
+    reservations.invalidate(machine_id)
+    return False
+
+@api.route('/api/reservations', methods=['GET'])
+@jwt_required()
+def get_reservations():
+    current_user_id = get_jwt_identity()
+    current_user_claims = get_jwt()
+    
+    if current_user_claims.get('is_admin'):
+        # Admins can see all reservations
+        query = Reservation.query
+    else:
+        # Regular users only see their own reservations
+        query = Reservation.query.filter_by(user_id=int(current_user_id))
+    
+    machine_id = request.args.get('machine_id', type=int)
+    if machine_id:
+        query = query.filter_by(machine_id=machine_id)
+    
+    status = request.args.get('status')
+    if status:
+        query = query.filter_by(status=status)
+    
+    reservation_list = query.order_by(Reservation.start_time).all()
+    
+    return jsonify({
+        'reservations': [reservation.to_json() for reservation in reservation_list],
+        'count': len(reservation_list)
+    })
+
+@api.route('/api/reservations', methods=['POST'])
+@jwt_required()
+def create_reservation():
+    try:
+        current_user_id = get_jwt_identity()
+        current_user_claims = get_jwt()
+        data = request.get_json()
+        
+        # Regular users can only book for themselves
+        if current_user_claims.get('is_admin'):
+            user_id = data.get('user_id', current_user_id)
+        else:
+            user_id = current_user_id
+        
+        machine_id = data.get('machine_id')
+        machine_type = data.get('machine_type')
+        try:
+            count = int(data.get('count', 1))
+        except (TypeError, ValueError):
+            return jsonify({'message': 'Count must be a whole number'}), 400
+        
+        if not data.get('start_time') or not data.get('end_time'):
+            return jsonify({'message': 'Start time and end time are required'}), 400
+        
+        if not machine_id and not machine_type:
+            return jsonify({'message': 'Machine ID or machine type is required'}), 400
+        
+        try:
+            start_time = parse_utc_datetime(data.get('start_time'))
+            end_time = parse_utc_datetime(data.get('end_time'))
+        except ValueError:
+            return jsonify({'message': 'Start time and end time must be ISO 8601 timestamps'}), 400
+        
+        if end_time <= start_time:
+            return jsonify({'message': 'End time must be after start time'}), 400
+        
+        if end_time <= datetime.utcnow():
+            return jsonify({'message': 'Cannot book a time window in the past'}), 400
+        
+        if count < 1:
+            return jsonify({'message': 'Count must be at least one'}), 400
+        
+        user = User.query.get(user_id)
+        if not user:
+            return jsonify({'message': 'User not found'}), 404
+        
+        if machine_id:
+            machine = Machine.query.get(machine_id)
+            if not machine:
+                return jsonify({'message': 'Machine not found'}), 404
+            
+            if has_booking_conflict(machine.id, start_time, end_time):
+                return jsonify({'message': f'Machine {machine.name} is already booked for this time'}), 400
+            
+            machines = [machine]
+        else:
+            # Pick the first free machines of the requested type
+            candidates = Machine.query.filter(
+                Machine.machine_type == machine_type,
+                Machine.status != 'Maintenance'
+            ).order_by(Machine.id).all()
+            
+            machines = []
+            for candidate in candidates:
+                if not has_booking_conflict(candidate.id, start_time, end_time):
+                    machines.append(candidate)
+                    if len(machines) == count:
+                        break
+            
+            if len(machines) < count:
+                return jsonify({
+                    'message': f'Only {len(machines)} {machine_type} machines are free for this time',
+                    'available': len(machines)
+                }), 400
+        
+        group_id = str(uuid.uuid4()) if len(machines) > 1 else None
+        new_reservations = [
+            Reservation(
+                user_id=user.id,
+                machine_id=machine.id,
+                start_time=start_time,
+                end_time=end_time,
+                status='Booked',
+                group_id=group_id,
+                note=data.get('note')
+            )
+            for machine in machines
+        ]
+        
+        # Flushing takes SQLite's write lock, so re-checking now sees every booking
+        # committed by other workers and none can commit until this one finishes
+        db.session.add_all(new_reservations)
+        db.session.flush()
+        
+        new_ids = [reservation.id for reservation in new_reservations]
+        for reservation in new_reservations:
+            clash = booked_in_window(
+                reservation.machine_id, start_time, end_time
+            ).filter(~Reservation.id.in_(new_ids)).first()
+            if clash:
+                machine_id = reservation.machine_id
+                db.session.rollback()
+                reservations.invalidate(machine_id)
+                return jsonify({'message': 'Machine was booked by another request for this time, please try again'}), 400
+        
+        reservations.bump()
+        db.session.commit()
+        
+        for reservation in new_reservations:
+            reservations.record_booking(reservation)
+        
+        return jsonify({
+            'message': 'Reservation created successfully',
+            'reservations': [reservation.to_json() for reservation in new_reservations],
+            'group_id': group_id
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Error creating reservation: {str(e)}'}), 500
+
+@api.route('/api/reservations/<int:id>/cancel', methods=['POST'])
+@jwt_required()
+def cancel_reservation(id):
+    try:
+        current_user_id = get_jwt_identity()
+        current_user_claims = get_jwt()
+        
+        reservation = Reservation.query.get(id)
+        if not reservation:
+            return jsonify({'message': 'Reservation not found'}), 404
+        
+        # Regular users can only cancel their own reservations
+        if not current_user_claims.get('is_admin') and int(current_user_id) != reservation.user_id:
+            return jsonify({'message': 'Unauthorized access'}), 403
+        
+        if reservation.status != 'Booked':
+            return jsonify({'message': f'Reservation is already {reservation.status.lower()}'}), 400
+        
+        reservation.status = 'Cancelled'
+        reservations.bump()
+        db.session.commit()
+        
+        reservations.release_booking(reservation)
+        
+        return jsonify({
+            'message': 'Reservation cancelled successfully',
+            'reservation': reservation.to_json()
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Error cancelling reservation: {str(e)}'}), 500
+
+@api.route('/api/machines/<int:id>/availability', methods=['GET'])
+@jwt_required()
+def get_machine_availability(id):
+    machine = Machine.query.get(id)
+    if not machine:
+        return jsonify({'message': 'Machine not found'}), 404
+    
+    # Default to the next 24 hours
+    try:
+        window_start = parse_utc_datetime(request.args['start']) if 'start' in request.args else datetime.utcnow()
+        window_end = parse_utc_datetime(request.args['end']) if 'end' in request.args else window_start + timedelta(days=1)
+    except ValueError:
+        return jsonify({'message': 'Start and end must be ISO 8601 timestamps'}), 400
+    
+    if window_end <= window_start:
+        return jsonify({'message': 'End must be after start'}), 400
+    
+    schedule = reservations.get_schedule(machine.id)
+    
+    def to_utc_iso(value):
+        return value.replace(tzinfo=dt_timezone.utc).isoformat()
+    
+    return jsonify({
+        'machine': machine.to_json(),
+        'booked': [
+            {'reservation_id': reservation_id, 'start_time': to_utc_iso(start), 'end_time': to_utc_iso(end)}
+            for start, end, reservation_id in schedule.overlapping(window_start, window_end)
+        ],
+        'free': [
+            {'start_time': to_utc_iso(start), 'end_time': to_utc_iso(end)}
+            for start, end in schedule.free_slots(window_start, window_end)
+        ]
+    })
+
 # Dashboard statistics
-@app.route('/api/dashboard/stats', methods=['GET'])
+@api.route('/api/dashboard/stats', methods=['GET'])
 @jwt_required()
 def get_dashboard_stats():
     try:
@@ -542,6 +1128,16 @@ def get_dashboard_stats():
         
         daily_revenue = sum(abs(t.amount) for t in recent_transactions)
         
+        # Lifetime totals include history that has been moved to the archive
+        live_revenue = db.session.query(db.func.sum(Transaction.amount)).filter(
+            Transaction.transaction_type == 'session_charge'
+        ).scalar() or 0
+        archived_revenue, archived_sessions = db.session.query(
+            db.func.sum(ArchiveSummary.session_revenue),
+            db.func.sum(ArchiveSummary.sessions_count)
+        ).one()
+        total_sessions = Session.query.count() + (archived_sessions or 0)
+        
         # Get recent sessions (last 10)
         recent_sessions = Session.query.order_by(Session.start_time.desc()).limit(10).all()
         
@@ -556,10 +1152,12 @@ def get_dashboard_stats():
                 'maintenance_machines': maintenance_machines
             },
             'session_stats': {
-                'active_sessions': active_sessions
+                'active_sessions': active_sessions,
+                'total_sessions': total_sessions
             },
             'revenue_stats': {
-                'daily_revenue': daily_revenue
+                'daily_revenue': daily_revenue,
+                'total_revenue': abs(live_revenue) + (archived_revenue or 0)
             },
             'recent_sessions': [session.to_json() for session in recent_sessions]
         })
@@ -567,8 +1165,149 @@ def get_dashboard_stats():
     except Exception as e:
         return jsonify({'message': f'Error fetching dashboard stats: {str(e)}'}), 500
 
+@api.route('/api/dashboard/revenue/monthly', methods=['GET'])
+@jwt_required()
+@admin_required()
+def get_monthly_revenue():
+    try:
+        months = {}
+        
+        def month_entry(month):
+            return months.setdefault(month, {
+                'month': month,
+                'sessions_count': 0,
+                'hours': 0.0,
+                'session_revenue': 0.0,
+                'deposits': 0.0
+            })
+        
+        # Archived months come from the rollup table
+        archived = db.session.query(
+            ArchiveSummary.month,
+            db.func.sum(ArchiveSummary.sessions_count),
+            db.func.sum(ArchiveSummary.hours),
+            db.func.sum(ArchiveSummary.session_revenue),
+            db.func.sum(ArchiveSummary.deposits)
+        ).group_by(ArchiveSummary.month).all()
+        
+        for month, sessions_count, hours, session_revenue, deposits in archived:
+            entry = month_entry(month)
+            entry['sessions_count'] += sessions_count or 0
+            entry['hours'] += hours or 0.0
+            entry['session_revenue'] += session_revenue or 0.0
+            entry['deposits'] += deposits or 0.0
+        
+        # Live months are aggregated in SQL
+        session_month = db.func.strftime('%Y-%m', Session.end_time)
+        live_sessions = db.session.query(
+            session_month,
+            db.func.count(Session.id),
+            db.func.sum(Session.duration)
+        ).filter(Session.is_active == False).group_by(session_month).all()
+        
+        for month, sessions_count, hours in live_sessions:
+            entry = month_entry(month)
+            entry['sessions_count'] += sessions_count or 0
+            entry['hours'] += hours or 0.0
+        
+        transaction_month = db.func.strftime('%Y-%m', Transaction.timestamp)
+        live_transactions = db.session.query(
+            transaction_month,
+            Transaction.transaction_type,
+            db.func.sum(Transaction.amount)
+        ).group_by(transaction_month, Transaction.transaction_type).all()
+        
+        for month, transaction_type, amount in live_transactions:
+            entry = month_entry(month)
+            if transaction_type == 'session_charge':
+                entry['session_revenue'] += abs(amount or 0)
+            elif transaction_type == 'deposit':
+                entry['deposits'] += amount or 0
+        
+        return jsonify({
+            'months': [months[month] for month in sorted(months)],
+            'count': len(months)
+        })
+        
+    except Exception as e:
+        return jsonify({'message': f'Error fetching monthly revenue: {str(e)}'}), 500
+
+# Archive routes
+@api.route('/api/archive', methods=['GET'])
+@jwt_required()
+@admin_required()
+def get_archive_months():
+    return jsonify({
+        'months': archive.list_months(),
+        'archive_after_days': current_app.config['ARCHIVE_AFTER_DAYS']
+    })
+
+@api.route('/api/archive/run', methods=['POST'])
+@jwt_required()
+@admin_required()
+def run_archive():
+    try:
+        data = request.get_json(silent=True) or {}
+        older_than_days = data.get('older_than_days')
+        
+        if older_than_days is not None:
+            try:
+                older_than_days = int(older_than_days)
+            except (TypeError, ValueError):
+                return jsonify({'message': 'older_than_days must be a whole number'}), 400
+            
+            if older_than_days < 1:
+                return jsonify({'message': 'older_than_days must be at least 1'}), 400
+        
+        result = archive.archive_old_records(older_than_days)
+        
+        return jsonify({
+            'message': 'Archive completed successfully',
+            'archived': result
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Error archiving records: {str(e)}'}), 500
+
+@api.route('/api/archive/<month>/<kind>', methods=['GET'])
+@jwt_required()
+def get_archived_records(month, kind):
+    current_user_id = get_jwt_identity()
+    current_user_claims = get_jwt()
+    
+    if not re.fullmatch(r'\d{4}-\d{2}', month):
+        return jsonify({'message': 'Month must be in YYYY-MM format'}), 400
+    
+    if kind not in ('sessions', 'transactions'):
+        return jsonify({'message': 'Unknown archive type'}), 404
+    
+    if current_user_claims.get('is_admin'):
+        # Admins can see everything, optionally for one user
+        user_id = request.args.get('user_id', type=int)
+    else:
+        # Regular users only see their own history
+        user_id = int(current_user_id)
+    
+    # Match on username too, in case the id belonged to a since-deleted account
+    username = None
+    if user_id is not None:
+        user = User.query.get(user_id)
+        if user:
+            username = user.username
+        elif not current_user_claims.get('is_admin'):
+            return jsonify({'message': 'User not found'}), 404
+    
+    records = archive.load_archived(kind, month, user_id, username)
+    
+    return jsonify({
+        kind: records,
+        'month': month,
+        'count': len(records)
+    })
+
 # Transaction history
-@app.route('/api/transactions', methods=['GET'])
+@api.route('/api/transactions', methods=['GET'])
 @jwt_required()
 def get_transactions():
     current_user_id = get_jwt_identity()
@@ -588,7 +1327,7 @@ def get_transactions():
         'count': len(transactions)
     })
 
-@app.route('/api/users/create', methods=['POST'])
+@api.route('/api/users/create', methods=['POST'])
 @jwt_required()
 @admin_required()
 def admin_create_user():
@@ -606,14 +1345,11 @@ def admin_create_user():
             return jsonify({'message': 'Username already exists'}), 400
             
         # Hash the password
+        from werkzeug.security import generate_password_hash
         hashed_password = generate_password_hash(password)
         
         # Generate avatar URL based on gender
-        img_url = None
-        if gender == "male":
-            img_url = f"https://avatar.iran.liara.run/public/boy?username={username}"
-        elif gender == "female":
-            img_url = f"https://avatar.iran.liara.run/public/girl?username={username}"
+        img_url = avatar_url(username, gender)
         
         # Create the user with specified admin status
         new_user = User(